@@ -1,16 +1,109 @@
 """
 A paint-style 2D toy dataset builder.
 The user clicks on the canvas to create groups of normally distributed points in one of the
-3 available colors. The canvas can be cleared, or the last point undone.
+3 available colors. The canvas can be cleared, or the last group of points undone.
 Dataset is scaled to zero mean and unit variance before saving.
-The dataset created can be saved to a .csv file. 
+The dataset created can be saved to a .csv, .feather or .parquet file.
 """
 
+import csv
+from itertools import repeat
+from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog as tkFileDialog
-from numpy.random import normal
+import numpy as np
 import pandas as pd
 from sklearn import preprocessing
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, the numeric kernels fall back to plain numpy without it
+    njit = None
+
+# integer codes of the point colors, as stored in the dataset and in saved files
+_COLOR_CODES = {"red": 0, "green": 1, "blue": 2}
+_COLOR_NAMES = np.array(["red", "green", "blue"])
+# file formats offered by the save and load dialogs, the format is chosen from the extension
+_FILETYPES = [("CSV", "*.csv"), ("Feather", "*.feather"), ("Parquet", "*.parquet")]
+
+def _safe_float(var, default):
+    """
+    Read a tk variable, falling back to default while its entry holds no valid number.
+    """
+    try:
+        return float(var.get())
+    except (tk.TclError, ValueError):
+        return default
+
+if njit is not None:
+    @njit(cache=True)
+    def _mask_within(xs, ys, ex, ey, r2, bufX, bufY):
+        """
+        Return a boolean mask of the points lying within sqrt(r2) of (ex, ey).
+        The compiled loop needs no temporaries, so the scratch buffers are unused.
+        """
+        mask = np.empty(len(xs), dtype=np.bool_)
+        for i in range(len(xs)):
+            dx = xs[i] - ex
+            dy = ys[i] - ey
+            mask[i] = dx * dx + dy * dy <= r2
+        return mask
+
+    @njit(cache=True)
+    def _affine_scatter(rand2, ex, ey, s, outX, outY):
+        """
+        Scale standard normal pairs by s and shift them to (ex, ey), writing into outX, outY.
+        """
+        for i in range(len(outX)):
+            outX[i] = ex + s * rand2[i, 0]
+            outY[i] = ey + s * rand2[i, 1]
+else:
+    def _mask_within(xs, ys, ex, ey, r2, bufX, bufY):
+        """
+        Return a boolean mask of the points lying within sqrt(r2) of (ex, ey).
+        The squared distances are computed in place in the scratch buffers bufX, bufY,
+        which must have the same length as xs.
+        """
+        np.subtract(xs, ex, out=bufX)
+        bufX *= bufX
+        np.subtract(ys, ey, out=bufY)
+        bufY *= bufY
+        bufX += bufY
+        return bufX <= r2
+
+    def _affine_scatter(rand2, ex, ey, s, outX, outY):
+        """
+        Scale standard normal pairs by s and shift them to (ex, ey), writing into outX, outY.
+        """
+        np.multiply(rand2[:, 0], s, out=outX)
+        outX += ex
+        np.multiply(rand2[:, 1], s, out=outY)
+        outY += ey
+
+def _make_scatter(dataset, pointClass, code, ss, ps):
+    """
+    Build a function drawing one group of points around a location, with the current class
+    and scatter parameters and the dataset methods it needs bound as closure variables.
+    Args:
+      dataset (Dataset): dataset the points are added to
+      pointClass (String): color of the points
+      code (int): color code of the points
+      ss (float): spread of the group
+      ps (int): number of points in the group
+    """
+    take = dataset._take_samples
+    paint = dataset._paint
+    append = dataset._append
+
+    def scatter(x, y):
+        chunk = take(ps)
+        listX = np.empty(ps)
+        listY = np.empty(ps)
+        _affine_scatter(chunk, x, y, ss, listX, listY)
+        paint(listX, listY, repeat(pointClass))
+        append(listX, listY, code)
+
+    return scatter
 
 class Dataset:
     """
@@ -25,20 +118,54 @@ class Dataset:
           sigmaScatter (tk.DoubleVar): spread of a group of points created by a click
           nbrPointsScatter (tk.DoubleVar): number of points per click group
         """
-        # myData is a list of coordinates and color for each point in the dataset
-        self.myData = []
-        # tkinter IDs for each data point
-        self.myPointsID = []
+        # coordinates and color code of each point in the dataset, stored as parallel arrays
+        # of which only the first _n entries are in use; they grow geometrically when full
+        self._n = 0
+        self._xs = np.empty(4096)
+        self._ys = np.empty(4096)
+        self._colors = np.empty(4096, dtype=np.int8)
+        # scratch space for the eraser distance computation, same capacity as the storage
+        self._scratch_a = np.empty(4096)
+        self._scratch_b = np.empty(4096)
+        # (start, end, box) index range and covered region of the points added by each click
+        # or file load, for undo
+        self._strokes = []
         # marker size for the point
         self.sizePoint = 2
         # Current class (color) attributed to next points being drawn ("blue", "green", "red")
         self.classPoint = "blue"
+        self._class_code = _COLOR_CODES[self.classPoint]
         self.drawingArea = drawingArea
         self.sigmaScatter = sigmaScatter
         self.nbrPointsScatter = nbrPointsScatter
+        # plain python copies of the tk variables, kept up to date by traces so that
+        # the event handlers do not query Tcl on every call
+        self._sigma = _safe_float(sigmaScatter, 0.0)
+        self._npts = _safe_float(nbrPointsScatter, 0.0)
+        sigmaScatter.trace_add("write", self._update_sigma)
+        nbrPointsScatter.trace_add("write", self._update_npts)
         self.last_drawn_x = None
         self.last_drawn_y = None
         self.threshold = 5
+        # latest motion event not handled yet, motion is processed once Tk is idle
+        self._pending = None
+        # points are painted into a single image instead of one canvas item per point,
+        # so the cost of redrawing the canvas does not grow with the size of the dataset
+        self._width = int(drawingArea.cget("width"))
+        self._height = int(drawingArea.cget("height"))
+        self._background = drawingArea.cget("background")
+        self._img = tk.PhotoImage(width=self._width, height=self._height)
+        self._img.put(self._background, to=(0, 0, self._width, self._height))
+        drawingArea.create_image(0, 0, anchor=tk.NW, image=self._img)
+        # pool of standard normal samples shared by the clicks, refilled once exhausted
+        self._rng = np.random.default_rng()
+        self._pool = np.empty((65536, 2))
+        self._refill_pool()
+        # compile the numeric kernels now rather than on the first click
+        _mask_within(self._xs[:0], self._ys[:0], 0.0, 0.0, 0.0,
+                     self._scratch_a[:0], self._scratch_b[:0])
+        _affine_scatter(self._pool[:0], 0.0, 0.0, 0.0, self._xs[:0], self._ys[:0])
+        self._specialize()
 
     def setClass(self, color):
         """
@@ -47,6 +174,43 @@ class Dataset:
           color (String): color for the next points that will be created
         """
         self.classPoint = color
+        # the eraser creates no points and has no color code
+        self._class_code = _COLOR_CODES.get(color)
+        self._specialize()
+
+    def _specialize(self):
+        """
+        Rebuild the scatter function after the class or the scatter parameters changed.
+        """
+        # clamp values to a reasonable interval
+        ss = float(max(min(self._sigma, 50), 0))
+        ps = int(max(min(self._npts, 1000), 0))
+        self._scatter = _make_scatter(self, self.classPoint, self._class_code, ss, ps)
+
+    def _take_samples(self, ps):
+        """
+        Return the next ps pairs of standard normal samples from the pool.
+        """
+        if self._pool_i + ps > len(self._pool):
+            self._refill_pool()
+        chunk = self._pool[self._pool_i:self._pool_i + ps]
+        self._pool_i += ps
+        return chunk
+
+    def _refill_pool(self):
+        """
+        Fill the sample pool with fresh standard normal draws.
+        """
+        self._rng.standard_normal(out=self._pool)
+        self._pool_i = 0
+
+    def _update_sigma(self, *args):
+        self._sigma = _safe_float(self.sigmaScatter, self._sigma)
+        self._specialize()
+
+    def _update_npts(self, *args):
+        self._npts = _safe_float(self.nbrPointsScatter, self._npts)
+        self._specialize()
 
     def pressButton(self, event):
         self.last_drawn_x = event.x
@@ -55,44 +219,141 @@ class Dataset:
         if self.classPoint == "erase":
             self._delete_points(event)
         else:
-            self.makeScatter(event)
+            self._scatter(float(event.x), float(event.y))
     
     def moveButton(self, event):
         if self.last_drawn_x is None:
             return
 
+        # fast drags queue many events, only the most recent one is worth drawing
+        if self._pending is None:
+            self.drawingArea.after_idle(self._flush_motion)
+        self._pending = event
+
+    def _flush_motion(self):
+        event = self._pending
+        self._pending = None
+        if event is None or self.last_drawn_x is None:
+            return
+
         move_distance = (self.last_drawn_x - event.x) ** 2  + (self.last_drawn_y - event.y) ** 2
         if move_distance >= self.threshold ** 2:
             self.pressButton(event)
 
     def releaseButton(self, event):
-        self.moveButton(event)
+        if self.last_drawn_x is not None:
+            self._pending = event
+            self._flush_motion()
 
         self.last_drawn_x = None
         self.last_drawn_y = None
 
-    def _draw_point(self, x, y, pointClass):
-        newpoint = self.drawingArea.create_oval(x - self.sizePoint, y - self.sizePoint,
-                                                x + self.sizePoint, y + self.sizePoint,
-                                                fill=pointClass)
-        self.myPointsID.append(newpoint)
-        self.myData.append((x, y, pointClass))
+    def _append(self, xs, ys, codes):
+        """
+        Add points to the dataset, growing the storage arrays if needed.
+        Args:
+          xs (np.ndarray): x coordinates of the new points
+          ys (np.ndarray): y coordinates of the new points
+          codes (int or np.ndarray): color code of the new points
+        """
+        start = self._n
+        end = start + len(xs)
+        if end > len(self._xs):
+            capacity = max(2 * len(self._xs), end)
+            self._xs = np.resize(self._xs, capacity)
+            self._ys = np.resize(self._ys, capacity)
+            self._colors = np.resize(self._colors, capacity)
+            self._scratch_a = np.empty(capacity)
+            self._scratch_b = np.empty(capacity)
+        self._xs[start:end] = xs
+        self._ys[start:end] = ys
+        self._colors[start:end] = codes
+        self._n = end
+        if end > start:
+            self._strokes.append((start, end, self._extent(xs, ys)))
+
+    def _paint(self, xs, ys, colors, box=None):
+        """
+        Paint the markers of the given points into the canvas image.
+        Args:
+          xs (np.ndarray): x coordinates of the points
+          ys (np.ndarray): y coordinates of the points
+          colors (iterable): color of each point
+          box (tuple): (x0, y0, x1, y1) region the markers are clipped to, whole image by default
+        """
+        if box is None:
+            box = (0, 0, self._width, self._height)
+        left, top, right, bottom = box
+        xs = np.floor(xs)
+        ys = np.floor(ys)
+        # call the Tcl command directly, PhotoImage.put rebuilds its argument tuple on every call
+        call = self._img.tk.call
+        name = self._img.name
+        x0 = np.clip(xs - self.sizePoint, left, right).astype(int)
+        y0 = np.clip(ys - self.sizePoint, top, bottom).astype(int)
+        x1 = np.clip(xs + self.sizePoint, left, right).astype(int)
+        y1 = np.clip(ys + self.sizePoint, top, bottom).astype(int)
+        visible = ((x0 < x1) & (y0 < y1)).tolist()
+        for a, b, c, d, color, v in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist(),
+                                        colors, visible):
+            if v:
+                call(name, "put", color, "-to", a, b, c, d)
+
+    def _repaint(self, box):
+        """
+        Clear a region of the canvas image and paint back the points overlapping it.
+        Args:
+          box (tuple): (x0, y0, x1, y1) region to redraw
+        """
+        left, top, right, bottom = box
+        left, top = max(left, 0), max(top, 0)
+        right, bottom = min(right, self._width), min(bottom, self._height)
+        if left >= right or top >= bottom:
+            return
+        box = (left, top, right, bottom)
+        self._img.put(self._background, to=box)
+        xs = self._xs[:self._n]
+        ys = self._ys[:self._n]
+        s = self.sizePoint + 1
+        near = (xs > left - s) & (xs < right + s) & (ys > top - s) & (ys < bottom + s)
+        colors = _COLOR_NAMES[self._colors[:self._n][near]].tolist()
+        self._paint(xs[near], ys[near], colors, box)
+
+    def _extent(self, xs, ys):
+        """
+        Return the (x0, y0, x1, y1) region covered by the markers of the given points.
+        """
+        s = self.sizePoint + 1
+        return (int(xs.min()) - s, int(ys.min()) - s, int(xs.max()) + s, int(ys.max()) + s)
 
     def _delete_points(self, event):
-        threshold = self.sigmaScatter.get()
-        threshold = threshold * threshold
-
-        lst_to_del = []
-        for i, coord in enumerate(self.myData):
-            x, y, color = coord
-            if (x - event.x) ** 2 + (y - event.y) ** 2 <= threshold:
-                lst_to_del.append(i)
-        print("deleting: ", lst_to_del)
-        for i in lst_to_del:
-            self.drawingArea.delete(self.myPointsID[i])
+        threshold = self._sigma * self._sigma
+
+        n = self._n
+        xs = self._xs[:n]
+        ys = self._ys[:n]
+        keep = ~_mask_within(xs, ys, float(event.x), float(event.y), threshold,
+                             self._scratch_a[:n], self._scratch_b[:n])
+        m = int(np.count_nonzero(keep))
+        if m == n:
+            return
 
-        self.myData = [val for i,val in enumerate(self.myData) if i not in lst_to_del]
-        self.myPointsID = [val for i,val in enumerate(self.myPointsID) if i not in lst_to_del]
+        box = self._extent(xs[~keep], ys[~keep])
+        # compact the surviving points to the front of the storage arrays, the points
+        # before the first erased one are already in place
+        first = int(np.argmin(keep))
+        tail = keep[first:]
+        self._xs[first:m] = xs[first:][tail]
+        self._ys[first:m] = ys[first:][tail]
+        self._colors[first:m] = self._colors[first:n][tail]
+        self._n = m
+        # shift the stroke ranges to the compacted indices, dropping the ones fully erased;
+        # their regions are kept, they still cover the remaining points
+        kept = np.concatenate(([0], np.cumsum(keep)))
+        bounds = kept[[(start, end) for start, end, _ in self._strokes]].tolist()
+        self._strokes = [(start, end, stroke[2]) for (start, end), stroke
+                         in zip(bounds, self._strokes) if start < end]
+        self._repaint(box)
 
 
     def makeScatter(self, event):
@@ -101,60 +362,75 @@ class Dataset:
         Args:
           event (tk.Event): tk user click event
         """
-        # clamp values to a reasonable interval
-        ss = max(min(self.sigmaScatter.get(), 50), 0)
-        ps = max(min(self.nbrPointsScatter.get(), 1000), 0)
-        listX = normal(loc=event.x, scale=ss, size=int(ps))
-        listY = normal(loc=event.y, scale=ss, size=int(ps))
-        for (x,y) in zip(listX, listY):
-            self.myData.append([x, y, self.classPoint])
-            newpoint = event.widget.create_oval(x-self.sizePoint, y-self.sizePoint, 
-                                                x+self.sizePoint, y+self.sizePoint,
-                                                fill=self.classPoint)
-            self.myPointsID.append(newpoint)
+        self._scatter(float(event.x), float(event.y))
 
     def saveData(self):
         """
-        Save the x,y,class properties of each drawn points to a csv file.
+        Save the x,y,class properties of each drawn points to a csv, feather or parquet file.
         Dataset is scaled to zero mean and unit variance before saving.
         """
-        saveTo = tkFileDialog.asksaveasfile(mode='w', defaultextension="")
-        if saveTo is None:
+        saveTo = tkFileDialog.asksaveasfilename(defaultextension=".csv", filetypes=_FILETYPES)
+        if not saveTo:
+            return None
+        n = self._n
+        suffix = Path(saveTo).suffix.lower()
+        if suffix in (".feather", ".parquet"):
+            df = pd.DataFrame({"x": self._xs[:n], "y": self._ys[:n], "color": self._colors[:n]})
+            if suffix == ".feather":
+                df.to_feather(saveTo)
+            else:
+                df.to_parquet(saveTo, compression="zstd")
             return None
-        df = pd.DataFrame(self.myData, columns = ["x","y","color"])
-        #scale to zero mean and unit variance
-        #df[['x','y']] = df[['x','y']].apply(lambda x: preprocessing.scale(x))
-        #df['x'] = (df['x'] - df['x'].min()) / (df['x'].max() - df['x'].min())
-        #df['y'] = (df['y'] - df['y'].min()) / (df['y'].max() - df['y'].min())
-        df['color'] = df['color'].replace({"red": 0, "green": 1, "blue": 2})
-        df.to_csv(saveTo.name, index=False)
-        saveTo.close()
+        # the rows are plain numbers, so write them directly instead of going through pandas
+        with open(saveTo, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(("x", "y", "color"))
+            writer.writerows(zip(self._xs[:n].tolist(), self._ys[:n].tolist(),
+                                 self._colors[:n].tolist()))
 
     def loadData(self):
         """
-        Load points from the csv file
+        Load points from a csv, feather or parquet file
         """
-        loadFrom = tkFileDialog.askopenfilename()
-        df = pd.read_csv(loadFrom)
-        df['color'] = df['color'].replace({0: "red", 1: "green", 2: "blue"})
-        
-        df.apply(lambda row: self._draw_point(row['x'], row['y'], row['color']), axis=1)
+        loadFrom = tkFileDialog.askopenfilename(filetypes=_FILETYPES + [("All files", "*")])
+        if not loadFrom:
+            return None
+        suffix = Path(loadFrom).suffix.lower()
+        if suffix == ".feather":
+            df = pd.read_feather(loadFrom)
+        elif suffix == ".parquet":
+            df = pd.read_parquet(loadFrom)
+        else:
+            df = pd.read_csv(loadFrom, dtype={"x": "float64", "y": "float64", "color": "int8"})
+        xs = df["x"].to_numpy()
+        ys = df["y"].to_numpy()
+        codes = df["color"].to_numpy()
+        # check the codes before using them as indices, negative ones would wrap around
+        unknown = (codes < 0) | (codes >= len(_COLOR_NAMES))
+        if unknown.any():
+            raise ValueError("unknown color codes in %s: %s"
+                             % (loadFrom, sorted(set(codes[unknown].tolist()))))
+        colors = _COLOR_NAMES[codes].tolist()
+
+        # add the whole file at once rather than point by point
+        self._paint(xs, ys, colors)
+        self._append(xs, ys, codes)
 
     def clearCanvas(self):
         """
         Remove all points on canvas.
         """
-        for pointID in self.myPointsID:
-            self.drawingArea.delete(pointID)
-        self.myPointsID = []
-        self.myData = []
+        self._img.put(self._background, to=(0, 0, self._width, self._height))
+        self._n = 0
+        self._strokes = []
 
     def undo(self):
         """
-        Remove the last drawn point. Raises exception if no points are defined.
+        Remove the last drawn group of points. Raises exception if no points are defined.
         """
-        self.myData.pop()
-        self.drawingArea.delete(self.myPointsID.pop())
+        start, end, box = self._strokes.pop()
+        self._n = start
+        self._repaint(box)
 
 
 if __name__ == "__main__":
@@ -186,10 +462,10 @@ if __name__ == "__main__":
 
     data = Dataset(drawingArea, sigmaScatter, nbrPointsScatter)
 
-    # bind mouse click to point drawing
-    drawingArea.bind("<Button>", data.pressButton)
-    drawingArea.bind("<Motion>", data.moveButton)
-    drawingArea.bind("<ButtonRelease>", data.releaseButton)
+    # bind left mouse button clicks and drags to point drawing
+    drawingArea.bind("<ButtonPress-1>", data.pressButton)
+    drawingArea.bind("<B1-Motion>", data.moveButton)
+    drawingArea.bind("<ButtonRelease-1>", data.releaseButton)
 
     # button positioning parameters
     width = 5